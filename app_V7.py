@@ -1,20 +1,18 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 from datetime import datetime, timedelta
 
-import plotly.express as px
-import plotly.graph_objects as go
-
 from urllib.parse import urlparse, parse_qs, urlencode, urlunparse
 import json
+import os
+import tempfile
+import time
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 import streamlit.components.v1 as components
 import requests
 import re
-from bs4 import BeautifulSoup
-
-# --- 關鍵匯入 ---
-# 引入 utils 中的 update_supabase_session 來同步權限
-from utils import supabase as data_client, get_market_data, update_supabase_session
 
 # 嘗試匯入 Supabase Client 設定，若版本過舊則提示
 try:
@@ -29,7 +27,20 @@ except Exception:
     st.error("❌ 偵測到 Supabase 套件版本過舊或未安裝。請確認 requirements.txt 內有 `supabase`，並重新部署。")
     st.stop()
 
-from logic import fetch_all_data, calculate_detailed_metrics, clean_df, save_daily_snapshot
+
+def _load_app_modules():
+    """登入後才載入重量級模組（plotly / utils / logic），加快登入畫面首繪
+
+    utils 會連帶拉起 yfinance 並初始化 Supabase data client，logic 也依賴它；
+    在登入畫面這些都用不到，延後載入可省數百 ms 的冷啟動時間。
+    """
+    global px, go
+    global data_client, get_market_data, update_supabase_session
+    global fetch_all_data, refresh_all_data, calculate_detailed_metrics, clean_df, save_daily_snapshot, empty_transactions_df
+    import plotly.express as px
+    import plotly.graph_objects as go
+    from utils import supabase as data_client, get_market_data, update_supabase_session
+    from logic import fetch_all_data, refresh_all_data, calculate_detailed_metrics, clean_df, save_daily_snapshot, empty_transactions_df
 
 # --- 1. 頁面基礎設定 ---
 st.set_page_config(page_title="全球資產管理系統 V7.5", layout="wide")
@@ -38,6 +49,12 @@ st.set_page_config(page_title="全球資產管理系統 V7.5", layout="wide")
 #      🇹🇼 台股代碼 -> 中文名稱（快取）
 # ==========================================
 
+# 共用連線：Session 會重用 TCP/TLS 連線（keep-alive）並要求 gzip 壓縮，
+# 比每次 requests.get 重新握手省 100–300ms，Big5 HTML 傳輸量也小很多
+_HTTP_SESSION = requests.Session()
+_HTTP_SESSION.headers.update({"Accept-Encoding": "gzip, deflate"})
+
+
 def _safe_get(url: str, headers=None, timeout: int = 10):
     """安全抓取（避免 Streamlit Cloud 偶發 SSL 憑證問題導致整個 APP 掛掉）
 
@@ -50,7 +67,7 @@ def _safe_get(url: str, headers=None, timeout: int = 10):
         verify = True
 
     try:
-        return requests.get(url, headers=headers, timeout=timeout, verify=verify)
+        return _HTTP_SESSION.get(url, headers=headers, timeout=timeout, verify=verify)
     except requests.exceptions.SSLError as e:
         # 部分環境可能缺少完整根憑證：退回不驗證憑證（公開資料抓取）
         try:
@@ -58,40 +75,77 @@ def _safe_get(url: str, headers=None, timeout: int = 10):
             urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
         except Exception:
             pass
-        return requests.get(url, headers=headers, timeout=timeout, verify=False)
+        return _HTTP_SESSION.get(url, headers=headers, timeout=timeout, verify=False)
+
+
+# TWSE 解析用 regex（預先編譯，避免每列重查 re 模組快取）
+_RE_WS = re.compile(r"\s+")
+_RE_CODE_NAME = re.compile(r"^([0-9A-Za-z]{4,8})\s+(.+)$")
+_RE_CODE_ONLY = re.compile(r"^[0-9A-Za-z]{4,8}$")
+
+
+# 全形空白 / NBSP -> 半形空白（translate 一趟 C 迴圈完成，不產生中間字串）
+_TRANS_TBL = str.maketrans({"\u3000": " ", "\xa0": " "})
 
 
 def _norm_twse_text(s: str) -> str:
-    s = str(s).replace("\u3000", " ").replace("　", " ").strip()
-    s = re.sub(r"\s+", " ", s)
-    return s
+    s = str(s).translate(_TRANS_TBL)
+    return _RE_WS.sub(" ", s).strip()
+
+def _iter_isin_rows_lxml(html: str) -> list:
+    """用 lxml.html 直接取出每列的文字 cells（迭代留在 C 層，比 bs4 快）
+
+    單趟走訪整份文件的 <tr>，不先對每張表 get_text 掃「有價證券代號及名稱」挑目標表
+    （那一步會把整個子樹的字串重建一次）；非資料列交給呼叫端的代碼 regex 過濾。
+    """
+    import lxml.html
+
+    root = lxml.html.fromstring(html)
+    rows = []
+    for tr in root.iter("tr"):
+        cells = [_norm_twse_text(c) for c in tr.xpath("./td//text()")]
+        if cells:
+            rows.append(cells)
+    return rows
+
+
+def _iter_isin_rows_bs4(html: str) -> list:
+    """bs4 保底路徑（沒裝 lxml 的環境用）"""
+    from bs4 import BeautifulSoup
 
-def _parse_isin_table(html: str) -> dict:
-    """解析 TWSE ISIN 清單頁：取出『代號 -> 中文名稱』"""
-    mp: dict = {}
     soup = BeautifulSoup(html, "html.parser")
 
     tables = soup.find_all("table")
     if not tables:
-        return mp
+        return []
 
-    # 優先找含「有價證券代號及名稱」字樣的表格
+    # 用 find(string=...) 掃字串節點找標頭，不用 get_text() 把整張表串成一個大字串
     target = None
-    for tbl in tables:
-        if "有價證券代號及名稱" in tbl.get_text():
-            target = tbl
-            break
-
-    # 找不到就取 tr 最多的那張表（保底）
+    header = soup.find(string=lambda s: s and "有價證券代號及名稱" in s)
+    if header is not None:
+        target = header.find_parent("table")
     if target is None:
         target = max(tables, key=lambda t: len(t.find_all("tr")))
 
+    rows = []
     for tr in target.find_all("tr"):
         tds = tr.find_all("td")
         if not tds:
             continue
+        rows.append([_norm_twse_text(td.get_text(" ", strip=True)) for td in tds])
+    return rows
+
+
+def _parse_isin_table(html: str) -> dict:
+    """解析 TWSE ISIN 清單頁：取出『代號 -> 中文名稱』"""
+    mp: dict = {}
+    numeric_codes: list = []
+    try:
+        rows = _iter_isin_rows_lxml(html)
+    except Exception:
+        rows = _iter_isin_rows_bs4(html)
 
-        cells = [_norm_twse_text(td.get_text(" ", strip=True)) for td in tds]
+    for cells in rows:
         if not cells:
             continue
 
@@ -105,7 +159,7 @@ def _parse_isin_table(html: str) -> dict:
         name = None
 
         # Case 1：第一欄就是「2330 台積電」這種格式
-        m = re.match(r"^([0-9A-Za-z]{4,8})\s+(.+)$", first)
+        m = _RE_CODE_NAME.match(first)
         if m:
             c = m.group(1).strip().upper()
             n = m.group(2).strip()
@@ -113,7 +167,7 @@ def _parse_isin_table(html: str) -> dict:
                 code, name = c, n
 
         # Case 2：欄位分開（第一欄是代碼、第二欄是名稱）
-        if code is None and re.fullmatch(r"[0-9A-Za-z]{4,8}", first) and len(cells) >= 2:
+        if code is None and _RE_CODE_ONLY.fullmatch(first) and len(cells) >= 2:
             c = first.strip().upper()
             n = cells[1].strip()
             if any(ch.isdigit() for ch in c) and n:
@@ -124,13 +178,63 @@ def _parse_isin_table(html: str) -> dict:
 
         mp[code] = name
         if code.isdigit():
-            mp[f"{code}.TW"] = name
+            numeric_codes.append(code)
 
+    # .TW 別名最後一次補齊，省掉每列的 f-string + dict 寫入
+    mp.update((f"{c}.TW", mp[c]) for c in numeric_codes)
     return mp
 
+# 磁碟快取：讓 TWSE 對照表撐過 Streamlit Cloud 冷啟動 / 重新部署（記憶體 cache 會清空）
+_TWSE_MAP_FILE = os.path.join(tempfile.gettempdir(), "twse_map.parquet")
+_TWSE_META_FILE = os.path.join(tempfile.gettempdir(), "twse_map_meta.json")
+_TWSE_QUERY_FILE = os.path.join(tempfile.gettempdir(), "twse_code_query.json")
+_TWSE_DISK_TTL = 86400
+
+
+def _load_twse_map_from_disk(ignore_ttl: bool = False) -> dict:
+    """從磁碟讀回 TWSE 對照表；過期或讀取失敗回傳空 dict"""
+    try:
+        if (not ignore_ttl) and time.time() - os.stat(_TWSE_MAP_FILE).st_mtime > _TWSE_DISK_TTL:
+            return {}
+        df = pd.read_parquet(_TWSE_MAP_FILE)
+        return dict(zip(df["code"], df["name"]))
+    except Exception:
+        return {}
+
+
+def _load_twse_meta() -> dict:
+    """讀回各 ISIN 頁的 ETag / Last-Modified（供條件式請求使用）"""
+    try:
+        with open(_TWSE_META_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+
+def _save_twse_meta(meta: dict):
+    try:
+        with open(_TWSE_META_FILE, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+    except Exception:
+        pass
+
+
+def _save_twse_map_to_disk(mp: dict):
+    """把 TWSE 對照表寫到磁碟（失敗不影響主流程）"""
+    try:
+        pd.DataFrame({"code": list(mp.keys()), "name": list(mp.values())}).to_parquet(_TWSE_MAP_FILE)
+    except Exception:
+        pass
+
+
 @st.cache_data(ttl=86400, show_spinner=False)
 def _load_twse_stock_map(_cache_bust: str = "v3") -> dict:
     """抓取上市/上櫃清單並合併（成功才會被 cache；失敗會丟例外避免 cache 空結果）"""
+    # 冷啟動時先試磁碟快取，省掉兩次 HTTP 抓取 + Big5 解碼 + 解析
+    mp = _load_twse_map_from_disk()
+    if len(mp) >= 500:
+        return mp
+
     headers = {
         "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36",
         "Accept-Language": "zh-TW,zh;q=0.9,en;q=0.8",
@@ -139,18 +243,49 @@ def _load_twse_stock_map(_cache_bust: str = "v3") -> dict:
     mp: dict = {}
 
     # strMode=2：上市、ETF 等；strMode=4：上櫃
-    for mode in ("2", "4"):
-        url = f"https://isin.twse.com.tw/isin/C_public.jsp?strMode={mode}"
-        r = _safe_get(url, headers=headers, timeout=30)
-        # ISIN 清單頁多為 Big5；避免 requests 誤判成 ISO-8859-1
-        if (not r.encoding) or (r.encoding.lower() == "iso-8859-1"):
-            r.encoding = "big5"
-        mp.update(_parse_isin_table(r.text))
+    # 兩個請求互相獨立，開雙線程並行抓，冷啟動 wall-clock 時間約減半
+    urls = [f"https://isin.twse.com.tw/isin/C_public.jsp?strMode={mode}" for mode in ("2", "4")]
+
+    # 條件式請求：清單沒變時 TWSE 回 304（空 body），連下載+解析都省掉
+    meta = _load_twse_meta()
+    stale_mp = _load_twse_map_from_disk(ignore_ttl=True)
+
+    def _fetch(url):
+        h = dict(headers)
+        v = meta.get(url) or {}
+        if stale_mp:
+            if v.get("etag"):
+                h["If-None-Match"] = v["etag"]
+            if v.get("last_modified"):
+                h["If-Modified-Since"] = v["last_modified"]
+        return _safe_get(url, headers=h, timeout=30)
+
+    with ThreadPoolExecutor(max_workers=2) as ex:
+        responses = list(ex.map(_fetch, urls))
+
+    if stale_mp and all(r.status_code == 304 for r in responses):
+        # 兩頁都沒變：直接沿用磁碟上的結果，更新 mtime 讓 TTL 重新起算
+        _save_twse_map_to_disk(stale_mp)
+        return stale_mp
+
+    for url, r in zip(urls, responses):
+        if r.status_code == 304:
+            # 只有一頁 304：保險起見整張重抓（兩頁在磁碟上是合併存的，拆不開）
+            r = _safe_get(url, headers=headers, timeout=30)
+        # ISIN 清單頁是 Big5：直接 decode bytes，跳過 r.text 的編碼偵測 heuristic
+        html = r.content.decode("big5", errors="replace")
+        mp.update(_parse_isin_table(html))
+        meta[url] = {
+            "etag": r.headers.get("ETag"),
+            "last_modified": r.headers.get("Last-Modified"),
+        }
 
     # 防呆：如果太小，代表抓取/解析失敗，不要 cache
     if len(mp) < 500:
         raise RuntimeError(f"TWSE mapping too small: {len(mp)}")
 
+    _save_twse_map_to_disk(mp)
+    _save_twse_meta(meta)
     return mp
 
 def get_twse_stock_map() -> dict:
@@ -163,6 +298,25 @@ def get_twse_stock_map() -> dict:
         print(f"TWSE 清單抓取/解析失敗: {e}")
         return {}
 
+def _load_code_query_cache() -> dict:
+    """codeQuery 的磁碟快取（單一小 JSON 檔，keyed by code）"""
+    try:
+        if time.time() - os.stat(_TWSE_QUERY_FILE).st_mtime > _TWSE_DISK_TTL:
+            return {}
+        with open(_TWSE_QUERY_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+
+def _save_code_query_cache(cache: dict):
+    try:
+        with open(_TWSE_QUERY_FILE, "w", encoding="utf-8") as f:
+            json.dump(cache, f, ensure_ascii=False)
+    except Exception:
+        pass
+
+
 @st.cache_data(ttl=86400, show_spinner=False)
 def _twse_code_query(code: str) -> str:
     """若全量清單抓不到，用 TWSE codeQuery 以代碼查名稱（結果會 cache）。"""
@@ -170,6 +324,11 @@ def _twse_code_query(code: str) -> str:
     if not code:
         return ""
 
+    # 磁碟快取：撐過冷啟動
+    disk_cache = _load_code_query_cache()
+    if code in disk_cache:
+        return disk_cache[code]
+
     headers = {
         "User-Agent": "Mozilla/5.0",
         "Accept-Language": "zh-TW,zh;q=0.9,en;q=0.8",
@@ -183,28 +342,33 @@ def _twse_code_query(code: str) -> str:
     except Exception:
         return ""
 
+    name = ""
     sugs = j.get("suggestions") or []
     for s in sugs:
         s = str(s)
         parts = s.split("\t")
         if parts and parts[0].strip() == code:
             if len(parts) > 1 and parts[1].strip():
-                return parts[1].strip()
+                name = parts[1].strip()
+                break
 
     # fallback：有些格式可能是「2330 台積電」
-    for s in sugs:
-        ss = _norm_twse_text(s)
-        if ss.startswith(code + " "):
-            return ss[len(code) + 1 :].strip()
-
-    return ""
-
-def get_tw_stock_name(code: str):
-    """回傳台股中文名稱；查不到則回傳 None"""
-    base = str(code).strip().upper().replace(".TW", "").replace(".TWO", "")
-    if not base:
-        return None
-
+    if not name:
+        for s in sugs:
+            ss = _norm_twse_text(s)
+            if ss.startswith(code + " "):
+                name = ss[len(code) + 1 :].strip()
+                break
+
+    if name:
+        disk_cache[code] = name
+        _save_code_query_cache(disk_cache)
+
+    return name
+
+@lru_cache(maxsize=4096)
+def _get_tw_stock_name_cached(base: str):
+    """以正規化後的代碼查名稱（in-process cache，同代碼重複查詢直接命中）"""
     mp = get_twse_stock_map()
     if mp:
         name = mp.get(base) or mp.get(f"{base}.TW")
@@ -220,15 +384,44 @@ def get_tw_stock_name(code: str):
     return qname if qname else None
 
 
-def _format_dt_series(s: pd.Series) -> pd.Series:
-    """把時間欄位格式化為 YYYY-MM-DD HH:MM（支援 timezone-aware / naive）"""
-    dt = pd.to_datetime(s, errors="coerce")
+def get_tw_stock_name(code: str):
+    """回傳台股中文名稱；查不到則回傳 None"""
+    base = str(code).strip().upper().replace(".TW", "").replace(".TWO", "")
+    if not base:
+        return None
+    return _get_tw_stock_name_cached(base)
+
+
+def get_tw_stock_names(codes) -> dict:
+    """批次版：一次查多個代碼，回傳 {原始代碼: 名稱}（查不到的不會出現在結果）"""
+    s = pd.Series(list(codes), dtype="object").dropna().astype(str).str.upper().str.strip()
+    base = s.str.replace(".TWO", "", regex=False).str.replace(".TW", "", regex=False)
+    mp = get_twse_stock_map()
+    names = base.map(mp) if mp else pd.Series(index=base.index, dtype="object")
+    out = {}
+    for orig, b, name in zip(s, base, names):
+        if pd.isna(name) or not name:
+            name = _get_tw_stock_name_cached(b)
+        if name:
+            out[orig] = name
+    return out
+
+
+@st.cache_data(show_spinner=False)
+def _format_dt_cached(values: tuple) -> list:
+    """實際的格式化（以值的 tuple 當快取 key，資料沒變的 rerun 直接命中）"""
+    dt = pd.to_datetime(pd.Series(values), errors="coerce")
     try:
         if getattr(dt.dt, "tz", None) is not None:
             dt = dt.dt.tz_convert("Asia/Taipei").dt.tz_localize(None)
     except Exception:
         pass
-    return dt.dt.strftime("%Y-%m-%d %H:%M")
+    return dt.dt.strftime("%Y-%m-%d %H:%M").tolist()
+
+
+def _format_dt_series(s: pd.Series) -> pd.Series:
+    """把時間欄位格式化為 YYYY-MM-DD HH:MM（支援 timezone-aware / naive）"""
+    return pd.Series(_format_dt_cached(tuple(s.tolist())), index=s.index)
 
 def _normalize_id(v):
     if v is None:
@@ -283,8 +476,12 @@ def _fmt_int_commas(v, blank: str = "") -> str:
         return str(v) if v is not None else blank
 
 
+@lru_cache(maxsize=256)
 def _pill_delta_html(delta_value: float, is_percent: bool = False) -> str:
-    """回傳『橢圓底色 + 上/下箭頭』的 HTML（上漲紅、下跌綠）。"""
+    """回傳『橢圓底色 + 上/下箭頭』的 HTML（上漲紅、下跌綠）。
+
+    數值沒變的 rerun 直接拿快取字串，不重組 HTML 模板。
+    """
     try:
         v = float(delta_value)
     except Exception:
@@ -306,6 +503,12 @@ def _pill_delta_html(delta_value: float, is_percent: bool = False) -> str:
     )
 
 
+@st.cache_data(show_spinner=False)
+def _sorted_snapshots(df: pd.DataFrame) -> pd.DataFrame:
+    """趨勢圖用的排序結果跨 rerun 快取，資料沒變就不重做 O(N log N) sort"""
+    return df.sort_values('snapshot_date')
+
+
 def _aggregate_snapshots_by_scale(df: pd.DataFrame, time_scale: str) -> pd.DataFrame:
     """依時間尺度(年/月/周/日)聚合 portfolio_snapshots，並以每期最後一筆代表該期趨勢。"""
     if df is None or df.empty:
@@ -343,6 +546,80 @@ def _aggregate_snapshots_by_scale(df: pd.DataFrame, time_scale: str) -> pd.DataF
     )
     return out
 
+def _deleted_ids(original_df: pd.DataFrame, edited_df: pd.DataFrame, table_name: str = None) -> list:
+    """向量化比對找出被刪除的 id（原本有、編輯後沒有），不必逐值 _normalize_id
+
+    fetch_all_data 已把各表的 id 集合存進 session_state（{table}_ids），
+    有的話直接用，省掉每次存檔重掃 original_df。
+    """
+    pre_ids = st.session_state.get(f"{table_name}_ids") if table_name else None
+    if pre_ids is not None:
+        orig = np.fromiter(pre_ids, dtype="int64", count=len(pre_ids))
+    elif original_df is None or original_df.empty or "id" not in original_df.columns:
+        return []
+    else:
+        orig = pd.to_numeric(original_df["id"], errors="coerce").dropna().astype("int64").to_numpy()
+    if edited_df is not None and "id" in edited_df.columns:
+        new = pd.to_numeric(edited_df["id"], errors="coerce").dropna().astype("int64").to_numpy()
+    else:
+        new = np.empty(0, dtype="int64")
+    return np.setdiff1d(orig, new).tolist()
+
+
+def _unchanged_ids(original_df: pd.DataFrame, edited_df: pd.DataFrame, cols: list) -> frozenset:
+    """比對編輯前後，找出內容完全沒動的 id 集合（這些列不必回寫 Supabase）
+
+    比對前先把格子正規化成字串（數字統一格式、日期取到天），
+    避免 100 vs 100.0 或 datetime vs date 這類格式差異造成假性變更。
+    拿不準的列一律視為有變更（多寫一筆無害，漏寫才是 bug）。
+    """
+    if original_df is None or original_df.empty or edited_df is None or edited_df.empty:
+        return frozenset()
+    if "id" not in original_df.columns or "id" not in edited_df.columns:
+        return frozenset()
+    cols = [c for c in cols if c in original_df.columns and c in edited_df.columns]
+    if not cols:
+        return frozenset()
+
+    def _norm(d):
+        ids = pd.to_numeric(d["id"], errors="coerce")
+        out = {}
+        for c in cols:
+            s = d[c]
+            if pd.api.types.is_datetime64_any_dtype(s):
+                out[c] = s.dt.strftime("%Y-%m-%d")
+                continue
+            num = pd.to_numeric(s, errors="coerce")
+            txt = s.astype(str).str.strip()
+            txt = txt.where(~txt.isin(("nan", "None", "<NA>", "NaT")), "")
+            out[c] = np.where(num.notna(), num.astype(float).map("{:.10g}".format), txt)
+        norm = pd.DataFrame(out, index=d.index)
+        norm = norm[ids.notna()]
+        norm.index = ids.dropna().astype("int64")
+        return norm
+
+    try:
+        a, b = _norm(original_df), _norm(edited_df)
+        common = a.index.intersection(b.index)
+        if len(common) == 0:
+            return frozenset()
+        same = (a.loc[common, cols].to_numpy() == b.loc[common, cols].to_numpy()).all(axis=1)
+        return frozenset(common[same])
+    except Exception:
+        return frozenset()
+
+
+def _bulk_upsert(table_name: str, rows: list, on_conflict: str):
+    """一次 round trip 寫入多列（PostgREST 要求同一批欄位一致，先依欄位組合分組）"""
+    if not rows:
+        return
+    groups = {}
+    for r in rows:
+        groups.setdefault(tuple(sorted(r.keys())), []).append(r)
+    for grp in groups.values():
+        data_client.table(table_name).upsert(grp, on_conflict=on_conflict).execute()
+
+
 def _delete_rows_by_ids(table_name: str, ids: list):
     """依 id 刪除多筆資料（Supabase PostgREST）"""
     ids = [i for i in ids if i is not None]
@@ -371,19 +648,23 @@ def _sync_liabilities(original_df: pd.DataFrame, edited_df_zh: pd.DataFrame):
         return
 
     # 1) 刪除：原本有、現在沒有的 id
-    orig_ids = set()
-    if original_df is not None and (not original_df.empty) and "id" in original_df.columns:
-        orig_ids = set(_normalize_id(x) for x in original_df["id"].dropna())
-    new_ids = set(_normalize_id(x) for x in df["id"].dropna())
-    del_ids = [i for i in orig_ids if i not in new_ids]
-    _delete_rows_by_ids("liabilities", del_ids)
+    _delete_rows_by_ids("liabilities", _deleted_ids(original_df, df, table_name="liabilities"))
 
     # 2) 更新 / 新增
     now_iso = datetime.now().isoformat()
     user_id = st.session_state.user_id
 
-    for _, row in df.iterrows():
+    # 收集成批次，一次 round trip 寫入（逐列打 API 會變成 O(N × RTT)）
+    # 內容沒動的列直接跳過，常見的「只改一列就存檔」只會寫回那一列
+    unchanged = _unchanged_ids(original_df, df, ["category", "name", "amount"])
+    to_add, to_update = [], []
+    cols = list(df.columns)
+    # itertuples 回傳普通 tuple，比 iterrows 每列建一個 Series 快一個數量級
+    for values in df.itertuples(index=False, name=None):
+        row = dict(zip(cols, values))
         rid = _normalize_id(row.get("id"))
+        if rid is not None and rid in unchanged:
+            continue
         name = str(row.get("name") or "").strip()
         if not name:
             continue  # 忽略空白列
@@ -393,14 +674,12 @@ def _sync_liabilities(original_df: pd.DataFrame, edited_df_zh: pd.DataFrame):
 
         if rid is None:
             # 新增：用 upsert（避免重複 name）
-            data_client.table("liabilities").upsert(
-                {"user_id": user_id, "category": cat, "name": name, "amount": amt, "updated_at": now_iso},
-                on_conflict="user_id, name",
-            ).execute()
+            to_add.append({"user_id": user_id, "category": cat, "name": name, "amount": amt, "updated_at": now_iso})
         else:
-            data_client.table("liabilities").update(
-                {"category": cat, "name": name, "amount": amt, "updated_at": now_iso}
-            ).eq("id", rid).execute()
+            to_update.append({"id": rid, "user_id": user_id, "category": cat, "name": name, "amount": amt, "updated_at": now_iso})
+
+    _bulk_upsert("liabilities", to_add, on_conflict="user_id, name")
+    _bulk_upsert("liabilities", to_update, on_conflict="id")
 
 def _sync_liquidity(original_df: pd.DataFrame, edited_df_zh: pd.DataFrame):
     """同步『流動資金』表格：支援編輯、刪除、（可選）新增"""
@@ -414,18 +693,19 @@ def _sync_liquidity(original_df: pd.DataFrame, edited_df_zh: pd.DataFrame):
         st.error("❌ 流動資金表格缺少 id 欄位，無法同步")
         return
 
-    orig_ids = set()
-    if original_df is not None and (not original_df.empty) and "id" in original_df.columns:
-        orig_ids = set(_normalize_id(x) for x in original_df["id"].dropna())
-    new_ids = set(_normalize_id(x) for x in df["id"].dropna())
-    del_ids = [i for i in orig_ids if i not in new_ids]
-    _delete_rows_by_ids("liquidity", del_ids)
+    _delete_rows_by_ids("liquidity", _deleted_ids(original_df, df, table_name="liquidity"))
 
     now_iso = datetime.now().isoformat()
     user_id = st.session_state.user_id
 
-    for _, row in df.iterrows():
+    unchanged = _unchanged_ids(original_df, df, ["account_name", "amount"])
+    to_add, to_update = [], []
+    cols = list(df.columns)
+    for values in df.itertuples(index=False, name=None):
+        row = dict(zip(cols, values))
         rid = _normalize_id(row.get("id"))
+        if rid is not None and rid in unchanged:
+            continue
         acc = str(row.get("account_name") or "").strip()
         if not acc:
             continue
@@ -433,14 +713,12 @@ def _sync_liquidity(original_df: pd.DataFrame, edited_df_zh: pd.DataFrame):
         amt = _safe_float(row.get("amount"), 0.0)
 
         if rid is None:
-            data_client.table("liquidity").upsert(
-                {"user_id": user_id, "account_name": acc, "amount": amt, "updated_at": now_iso},
-                on_conflict="user_id, account_name",
-            ).execute()
+            to_add.append({"user_id": user_id, "account_name": acc, "amount": amt, "updated_at": now_iso})
         else:
-            data_client.table("liquidity").update(
-                {"account_name": acc, "amount": amt, "updated_at": now_iso}
-            ).eq("id", rid).execute()
+            to_update.append({"id": rid, "user_id": user_id, "account_name": acc, "amount": amt, "updated_at": now_iso})
+
+    _bulk_upsert("liquidity", to_add, on_conflict="user_id, account_name")
+    _bulk_upsert("liquidity", to_update, on_conflict="id")
 
 def _sync_income_history(original_df: pd.DataFrame, edited_df_zh: pd.DataFrame):
     """同步『收入』表格：支援編輯、刪除、（可選）新增"""
@@ -456,17 +734,19 @@ def _sync_income_history(original_df: pd.DataFrame, edited_df_zh: pd.DataFrame):
         st.error("❌ 收入表格缺少 id 欄位，無法同步")
         return
 
-    orig_ids = set()
-    if original_df is not None and (not original_df.empty) and "id" in original_df.columns:
-        orig_ids = set(_normalize_id(x) for x in original_df["id"].dropna())
-    new_ids = set(_normalize_id(x) for x in df["id"].dropna())
-    del_ids = [i for i in orig_ids if i not in new_ids]
-    _delete_rows_by_ids("income_history", del_ids)
+    _delete_rows_by_ids("income_history", _deleted_ids(original_df, df, table_name="income_history"))
 
     user_id = st.session_state.user_id
+    now_iso = datetime.now().isoformat()
 
-    for _, row in df.iterrows():
+    unchanged = _unchanged_ids(original_df, df, ["年收入", "備註"])
+    to_insert, to_update = [], []
+    cols = list(df.columns)
+    for values in df.itertuples(index=False, name=None):
+        row = dict(zip(cols, values))
         rid = _normalize_id(row.get("id"))
+        if rid is not None and rid in unchanged:
+            continue
         ann = row.get("年收入")
         note = str(row.get("備註") or "").strip()
 
@@ -487,16 +767,18 @@ def _sync_income_history(original_df: pd.DataFrame, edited_df_zh: pd.DataFrame):
         if rid is None:
             if ann_val is None:
                 continue
-            data_client.table("income_history").insert(
-                {"user_id": user_id, "紀錄日期": datetime.now().isoformat(), "年收入": ann_val, "備註": note}
-            ).execute()
+            to_insert.append(
+                {"user_id": user_id, "紀錄日期": now_iso, "年收入": ann_val, "備註": note}
+            )
         else:
-            payload = {}
+            payload = {"id": rid, "user_id": user_id, "備註": note}
             if ann_val is not None:
                 payload["年收入"] = ann_val
-            payload["備註"] = note
-            if payload:
-                data_client.table("income_history").update(payload).eq("id", rid).execute()
+            to_update.append(payload)
+
+    if to_insert:
+        data_client.table("income_history").insert(to_insert).execute()
+    _bulk_upsert("income_history", to_update, on_conflict="id")
 
 def _sync_transactions(original_df: pd.DataFrame, edited_df: pd.DataFrame):
     """同步『交易』表格：支援編輯、刪除、（可選）新增"""
@@ -512,22 +794,42 @@ def _sync_transactions(original_df: pd.DataFrame, edited_df: pd.DataFrame):
         st.error("❌ 交易表格缺少 id 欄位，無法同步")
         return
 
-    orig_ids = set()
-    if original_df is not None and (not original_df.empty) and "id" in original_df.columns:
-        orig_ids = set(_normalize_id(x) for x in original_df["id"].dropna())
-    new_ids = set(_normalize_id(x) for x in df["id"].dropna())
-    del_ids = [i for i in orig_ids if i not in new_ids]
-    _delete_rows_by_ids("transactions", del_ids)
+    _delete_rows_by_ids("transactions", _deleted_ids(original_df, df, table_name="transactions"))
 
     user_id = st.session_state.user_id
 
-    for _, row in df.iterrows():
-        rid = _normalize_id(row.get("id"))
-        t_type = str(row.get("類型") or "").strip()
-        t_cat = str(row.get("類別") or "").strip()
-        ticker = str(row.get("代碼") or "").upper().strip()
-        qty = _safe_float(row.get("數量"), 0.0)
-        price = _safe_float(row.get("單價"), 0.0)
+    # 先整欄向量化轉型，行內就不需要逐值 try/except（例外流程控制在 CPython 很貴）
+    if "id" in df.columns:
+        df["id"] = pd.to_numeric(df["id"], errors="coerce").astype("Int64")
+    for num_col in ("數量", "單價"):
+        if num_col in df.columns:
+            df[num_col] = pd.to_numeric(df[num_col], errors="coerce").fillna(0.0)
+    if "日期" in df.columns:
+        df["日期"] = pd.to_datetime(df["日期"], errors="coerce").dt.date
+    # 文字欄整欄 strip/upper 一次；類型/類別重複值多，轉 category 共用字串物件
+    for txt_col in ("類型", "類別", "代碼"):
+        if txt_col in df.columns:
+            df[txt_col] = df[txt_col].astype("string").fillna("").str.strip()
+    if "代碼" in df.columns:
+        df["代碼"] = df["代碼"].str.upper()
+    for cat_col in ("類型", "類別"):
+        if cat_col in df.columns:
+            df[cat_col] = df[cat_col].astype("category")
+
+    unchanged = _unchanged_ids(original_df, df, ["類型", "類別", "代碼", "數量", "單價", "日期"])
+    to_insert, to_update = [], []
+    cols = list(df.columns)
+    for values in df.itertuples(index=False, name=None):
+        row = dict(zip(cols, values))
+        rid_v = row.get("id")
+        rid = None if pd.isna(rid_v) else int(rid_v)
+        if rid is not None and rid in unchanged:
+            continue
+        t_type = str(row.get("類型") or "")
+        t_cat = str(row.get("類別") or "")
+        ticker = str(row.get("代碼") or "")
+        qty = row.get("數量", 0.0)
+        price = row.get("單價", 0.0)
         date_v = row.get("日期")
 
         # 忽略空白列
@@ -535,10 +837,7 @@ def _sync_transactions(original_df: pd.DataFrame, edited_df: pd.DataFrame):
             if rid is None:
                 continue
 
-        try:
-            date_iso = pd.to_datetime(date_v, errors="coerce").date().isoformat() if date_v else None
-        except Exception:
-            date_iso = None
+        date_iso = date_v.isoformat() if (date_v is not None and pd.notna(date_v)) else None
 
         payload = {
             "user_id": user_id,
@@ -554,10 +853,14 @@ def _sync_transactions(original_df: pd.DataFrame, edited_df: pd.DataFrame):
         payload = {k: v for k, v in payload.items() if v is not None}
 
         if rid is None:
-            data_client.table("transactions").insert(payload).execute()
+            to_insert.append(payload)
         else:
-            payload.pop("user_id", None)  # 更新時不必動到 user_id
-            data_client.table("transactions").update(payload).eq("id", rid).execute()
+            payload["id"] = rid
+            to_update.append(payload)
+
+    if to_insert:
+        data_client.table("transactions").insert(to_insert).execute()
+    _bulk_upsert("transactions", to_update, on_conflict="id")
 
 # ==========================================
 #      🔐 登入邏輯 (Session Storage + Sync)
@@ -691,6 +994,11 @@ def _inject_cv_into_redirect_to(oauth_url: str, cv_key: str, cv_value: str) -> s
 
 def handle_login():
     """處理登入流程與同步（Supabase OAuth code -> session）"""
+    # 穩態 rerun：已登入且 session 同步過就直接跳過，
+    # 不用每次互動都打 get_session（會碰 token、偶爾還觸發 refresh RPC）
+    if st.session_state.get("user") and st.session_state.get("_session_synced"):
+        return
+
     auth_client = st.session_state.get("auth_client")
     if auth_client is None:
         st.error("❌ auth_client 尚未初始化（st.session_state.auth_client 不存在）")
@@ -702,7 +1010,10 @@ def handle_login():
         if session and getattr(session, "user", None):
             st.session_state.user = session.user
             st.session_state.user_id = session.user.id
+            # 已登入才載入 utils（未登入時不付 yfinance/data client 的載入成本）
+            from utils import update_supabase_session
             update_supabase_session(session.access_token, session.refresh_token)
+            st.session_state._session_synced = True
             return
     except Exception:
         pass
@@ -735,7 +1046,9 @@ def handle_login():
             if user and session:
                 st.session_state.user = user
                 st.session_state.user_id = user.id
+                from utils import update_supabase_session
                 update_supabase_session(session.access_token, session.refresh_token)
+                st.session_state._session_synced = True
 
                 clear_url()
                 st.rerun()
@@ -834,14 +1147,18 @@ if not st.session_state.user:
 #      🚀 主程式邏輯 (登入成功後)
 # ==========================================
 
-# 再次確保 Session 同步 (雙重保險，針對頁面重新整理的情況)
-if st.session_state.user:
+# 通過登入閘門後才載入重量級模組
+_load_app_modules()
+
+# 再次確保 Session 同步（只在 handle_login 沒同步成功時補做，不用每次 rerun 都打 get_session）
+if st.session_state.user and not st.session_state.get("_session_synced"):
     try:
         session = st.session_state.auth_client.auth.get_session()
         if session:
             update_supabase_session(session.access_token, session.refresh_token)
-    except:
-        pass
+            st.session_state._session_synced = True
+    except Exception as e:
+        print(f"Session 補同步失敗: {e}")
 
 # 初始化資料
 if 'transactions' not in st.session_state:
@@ -850,7 +1167,7 @@ if 'transactions' not in st.session_state:
             fetch_all_data()
         except Exception as e:
             # 初始化空的資料結構以免報錯 (針對新帳號)
-            st.session_state.transactions = pd.DataFrame(columns=['id', 'user_id', '類型', '類別', '代碼', '數量', '單價', '日期'])
+            st.session_state.transactions = empty_transactions_df()
             st.session_state.income_df = pd.DataFrame()
             st.session_state.liabilities_df = pd.DataFrame()
             st.session_state.liquidity_df = pd.DataFrame()
@@ -863,17 +1180,27 @@ if 'transactions' not in st.session_state:
 
 # 靜態資料
 PR_DATA_113 = {10: 33.0, 20: 38.6, 30: 44.0, 40: 49.3, 50: 54.6, 60: 61.4, 70: 71.9, 80: 88.5, 90: 131.2}
+# 預排好的 PR 門檻陣列：查 bucket 用 searchsorted，不必每次 rerun 走 Python 迴圈
+_PR_ITEMS = sorted(PR_DATA_113.items())
+_PR_KEYS = np.array([k for k, _ in _PR_ITEMS])
+_PR_VALS = np.array([v for _, v in _PR_ITEMS])
 
 # --- 2. 核心數據運算 ---
 total_market_val, total_holding_cost, current_ex_rate = 0, 0, 32.5
 holdings_df, detailed_tx_global = pd.DataFrame(), pd.DataFrame()
 total_pnl, realized_all = 0, 0
 
+@st.cache_data(show_spinner=False)
+def _ticker_tuple(tx_df: pd.DataFrame) -> tuple:
+    """交易表 -> 排序去重的代碼 tuple（穩定、可雜湊，讓下游報價快取有效命中）"""
+    return tuple(sorted(set(tx_df['代碼'].dropna().astype(str))))
+
 # A. 即時投資數據計算
 if not st.session_state.transactions.empty:
-    t_list = st.session_state.transactions['代碼'].dropna().unique().tolist()
+    t_list = _ticker_tuple(st.session_state.transactions)
     prices, current_ex_rate = get_market_data(t_list)
-    holdings_df, realized_all, detailed_tx_global = calculate_detailed_metrics(st.session_state.transactions, current_ex_rate)
+    # 儀表板不需要逐筆損益明細，detailed=False 省掉明細表組裝
+    holdings_df, realized_all, _ = calculate_detailed_metrics(st.session_state.transactions, current_ex_rate, detailed=False)
     
     if not holdings_df.empty:
         # ✅ 台股代碼 -> 中文名稱（第一次會抓取全量清單並快取）
@@ -881,21 +1208,29 @@ if not st.session_state.transactions.empty:
             holdings_df['顯示名稱'] = holdings_df['代碼']
         mask_tw = holdings_df['類別'] == '台股'
         if mask_tw.any():
-            def _tw_disp(code):
-                base = str(code).upper().replace('.TW', '').strip()
-                name = get_tw_stock_name(base)
-                return f"{name}({base})" if name else base
-            holdings_df.loc[mask_tw, '顯示名稱'] = holdings_df.loc[mask_tw, '代碼'].apply(_tw_disp)
-
-        holdings_df['現價'] = holdings_df['代碼'].map(prices).fillna(0)
-        holdings_df['匯率'] = holdings_df['類別'].apply(lambda x: current_ex_rate if x != '台股' else 1.0)
-        holdings_df['市值(TWD)'] = holdings_df['現價'] * holdings_df['持倉數量'] * holdings_df['匯率']
-        holdings_df['成本(TWD)'] = holdings_df['平均成本'] * holdings_df['持倉數量'] * holdings_df['匯率']
-        holdings_df['損益(TWD)'] = holdings_df['市值(TWD)'] - holdings_df['成本(TWD)']
-        holdings_df['報酬率'] = (holdings_df['損益(TWD)'] / holdings_df['成本(TWD)'].replace(0, 1)) * 100
-        
-        total_market_val = holdings_df['市值(TWD)'].sum()
-        total_holding_cost = holdings_df['成本(TWD)'].sum()
+            # 只對 unique 代碼查一次名稱，再整欄組回顯示字串（避免逐列 apply）
+            bases = holdings_df.loc[mask_tw, '代碼'].astype(str).str.upper().str.replace('.TW', '', regex=False).str.strip()
+            name_map = {b: (get_tw_stock_name(b) or '') for b in bases.unique()}
+            holdings_df.loc[mask_tw, '顯示名稱'] = [
+                f"{name_map[b]}({b})" if name_map[b] else b for b in bases
+            ]
+
+        # 四個衍生欄位用共用的 ndarray 暫存一次算完，少掉中間 Series 的來回配置
+        px_arr = holdings_df['代碼'].map(prices).fillna(0).to_numpy(dtype=float)
+        fx_arr = np.where(holdings_df['類別'].to_numpy() == '台股', 1.0, current_ex_rate)
+        qty_fx = holdings_df['持倉數量'].to_numpy(dtype=float) * fx_arr
+        mv_arr = px_arr * qty_fx
+        cost_arr = holdings_df['平均成本'].to_numpy(dtype=float) * qty_fx
+        pnl_arr = mv_arr - cost_arr
+        roi_arr = pnl_arr / np.where(cost_arr != 0, cost_arr, 1.0) * 100
+        # 六個欄位一次 assign（單次 BlockManager 重建，不用六次 __setitem__）
+        holdings_df = holdings_df.assign(**{
+            '現價': px_arr, '匯率': fx_arr, '市值(TWD)': mv_arr,
+            '成本(TWD)': cost_arr, '損益(TWD)': pnl_arr, '報酬率': roi_arr,
+        })
+
+        total_market_val = float(mv_arr.sum())
+        total_holding_cost = float(cost_arr.sum())
         total_pnl = (total_market_val - total_holding_cost) + realized_all
 
 # B. 流動資金與負債計算
@@ -907,95 +1242,39 @@ net_assets = total_market_val + total_liquidity - total_liabilities
 save_daily_snapshot(total_market_val, total_liquidity, total_liabilities, net_assets)
 
 # --- 3. 精準時間段對比邏輯 ---
+@st.cache_data(show_spinner=False)
+def _snapshot_index(df: pd.DataFrame):
+    """把快照表轉成排序好的 (日期陣列, 數值矩陣)；同一份 df 的轉換跨 rerun 共用"""
+    dates = pd.to_datetime(df['snapshot_date'], errors='coerce').dt.date.to_numpy()
+    order = np.argsort(dates)
+    values = df[['market_value', 'liquidity_amount', 'liabilities_amount', 'net_assets']].to_numpy()[order]
+    return dates[order], values
+
 def get_historical_stats(days_back=None, start_date=None):
     if 'snapshots_df' not in st.session_state or st.session_state.snapshots_df.empty:
         return total_market_val, total_liquidity, total_liabilities, net_assets
-    df_s = st.session_state.snapshots_df.copy()
-    df_s['snapshot_date'] = pd.to_datetime(df_s['snapshot_date']).dt.date
+    dates, values = _snapshot_index(st.session_state.snapshots_df)
     target_date = start_date if start_date else (datetime.now().date() - timedelta(days=days_back if days_back else 0))
-    past_records = df_s[df_s['snapshot_date'] <= target_date]
-    rec = past_records.iloc[0] if not past_records.empty else df_s.iloc[-1]
-    return rec['market_value'], rec['liquidity_amount'], rec['liabilities_amount'], rec['net_assets']
-
-# --- 4. 側邊欄：資產輸入 ---
-with st.sidebar:
-    st.title("🛡️ 雲端資產管理 V7.5")
-    
-    if st.session_state.user:
-        user_email = st.session_state.user.email
-        st.caption(f"👤 已登入: {user_email}")
-        if st.button("登出系統", type="secondary"):
-            # 登出
-            st.session_state.auth_client.auth.sign_out()
-            st.session_state.clear()
-            st.rerun()
-    st.divider()
-
-    with st.form("trade_form", clear_on_submit=True):
-        st.subheader("📝 新增投資交易")
-        t_type = st.radio("交易類型", ["買入", "賣出"], horizontal=True)
-        t_cat = st.selectbox("資產類別", ["台股", "美股", "加密貨幣", "貴金屬"])
-        t_ticker = st.text_input("標的代碼 (如 2330, TSLA)").upper().strip()
-
-        # 台股代碼即時顯示中文名稱（第一次會抓取全量清單並快取）
-        if t_cat == "台股" and t_ticker:
-            tw_name = get_tw_stock_name(t_ticker)
-            if tw_name:
-                st.caption(f"📌 股票名稱：{tw_name}")
-            else:
-                st.caption("⚠️ 查無此台股代碼（仍可存入）")
-        t_qty = st.number_input("數量", min_value=0.0, format="%.4f")
-        t_price = st.number_input("單價", min_value=0.0, format="%.4f")
-        t_date = st.date_input("交易日期", datetime.now())
-        if st.form_submit_button("✅ 存入雲端數據庫"):
-            if t_ticker and t_qty > 0:
-                data = {"user_id": st.session_state.user_id, "類型": t_type, "類別": t_cat, "代碼": t_ticker, "數量": t_qty, "單價": t_price, "日期": t_date.isoformat()}
-                data_client.table("transactions").insert(data).execute()
-                fetch_all_data(); st.rerun()
-
-# --- 5. 主畫面內容 ---
-tab1, tab_liab, tab2, tab3 = st.tabs(["📊 資產儀表板", "📉 負債管理", "💰 收入與流動資金", "🎯 FIRE 規劃"])
-
-# --- Tab 1: 資產儀表板 ---
-with tab1:
-    title_col, filter_col = st.columns([3, 1])
-    with title_col: st.subheader("📊 全球資產概況")
-    with filter_col:
-        time_range = st.selectbox("對比基準點", ["不對比", "日 (前一日)", "月 (前一月)", "年 (前一年)", "自定義"], label_visibility="collapsed")
-    
-    # 執行對比邏輯
-    if time_range == "日 (前一日)": hist_m, hist_l, hist_liab, hist_net = get_historical_stats(days_back=1)
-    elif time_range == "月 (前一月)": hist_m, hist_l, hist_liab, hist_net = get_historical_stats(days_back=30)
-    elif time_range == "年 (前一年)": hist_m, hist_l, hist_liab, hist_net = get_historical_stats(days_back=365)
-    elif time_range == "自定義":
-        d_range = st.date_input("開始日期", value=(datetime.now() - timedelta(days=7)), label_visibility="collapsed")
-        hist_m, hist_l, hist_liab, hist_net = get_historical_stats(start_date=d_range)
-    else: hist_m, hist_l, hist_liab, hist_net = total_market_val, total_liquidity, total_liabilities, net_assets
-
-    net_delta, liq_delta, mkt_delta = net_assets - hist_net, total_liquidity - hist_l, total_market_val - hist_m
-
-    col_m1, col_m2, col_m3, col_m4, col_m5 = st.columns(5)
-    delta_tag = f"({time_range})" if time_range != "不對比" else None
-    
-    with col_m1: st.metric("淨資產 (TWD)", f"NT$ {net_assets:,.0f}", delta=f"{net_delta:,.0f}" if delta_tag else None, help=delta_tag, delta_color="inverse")
-    with col_m2: st.metric("目前流動資金", f"NT$ {total_liquidity:,.0f}", delta=f"{liq_delta:,.0f}" if delta_tag else None, delta_color="inverse")
-    with col_m3:
-        m_c = "#D62728" if mkt_delta >= 0 else "#2CA02C"
-        delta_str = f"{mkt_delta:+,.0f}" if delta_tag else ""
-        st.markdown(f"<p style='color:gray; font-size:16px;'>投資總市值</p><h2 style='margin-top:-15px;'>NT$ {total_market_val:,.0f}</h2><p style='color:{m_c}; font-size:14px; margin-top:-10px;'>{delta_str} <span style='color:gray;'>| 成本: {total_holding_cost:,.0f}</span></p>", unsafe_allow_html=True)
-    with col_m4:
-        p_c = "#D62728" if total_pnl >= 0 else "#2CA02C"
-        st.markdown(f"<p style='color:gray; font-size:16px;'>累積總損益</p><h2 style='color:{p_c}; margin-top:-15px;'>NT$ {total_pnl:,.0f}</h2><p style='color:{p_c}; font-size:14px; margin-top:-10px;'>{(total_pnl/total_holding_cost*100 if total_holding_cost else 0):+.2f}% (ROI)</p>", unsafe_allow_html=True)
-    with col_m5: st.metric("總負債額", f"NT$ {total_liabilities:,.0f}", delta=f"-{total_liabilities:,.0f}" if total_liabilities > 0 else None, delta_color="inverse")
-
-    st.divider()
-
+    # O(log N) 找出 target_date 當天（或之前）最後一筆；沒有更早的就退回最舊一筆
+    idx = int(np.searchsorted(dates, target_date, side='right')) - 1
+    if idx < 0:
+        idx = 0
+    m_val, l_val, liab_val, net_val = values[idx]
+    return m_val, l_val, liab_val, net_val
+
+# st.fragment：圖表區塊可獨立 rerun（例如切換 X 軸時間尺度時不必重跑整個 script）；
+# 舊版 streamlit 沒有 fragment 就退化成一般函式，行為不變
+_fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None) or (lambda f: f)
+
+@_fragment
+def _render_trend_and_pie(total_market_val, total_liquidity, total_liabilities):
+    """儀表板左側趨勢圖 + 右側資產圓餅圖"""
     c_l, c_r = st.columns([2, 1])
     with c_l:
         if not st.session_state.snapshots_df.empty:
             # 讓使用者選擇 X 軸時間尺度（年/月/周/日；不細分到小時）
             time_scale = st.selectbox("X 軸時間尺度", ["日", "周", "月", "年"], index=0, key="trend_time_scale")
-            df_plot_raw = st.session_state.snapshots_df.sort_values('snapshot_date')
+            df_plot_raw = _sorted_snapshots(st.session_state.snapshots_df)
             df_plot = _aggregate_snapshots_by_scale(df_plot_raw, time_scale)
 
             # 1. 定義中文名稱對照表
@@ -1024,12 +1303,21 @@ with tab1:
         pie_df = pd.DataFrame({"項目": ["投資", "流動資金", "負債"], "金額": [total_market_val, total_liquidity, total_liabilities]})
         st.plotly_chart(px.pie(pie_df, values='金額', names='項目', hole=0.4, color_discrete_sequence=["#ff7f0e", "#2ca02c", "#d62728"]), use_container_width=True)
 
-    st.divider()
+@_fragment
+def _render_asset_tabs(holdings_df, total_market_val, current_ex_rate):
+    """各資產類別的長條圖 / 持倉明細 / 小計指標"""
     asset_tabs = st.tabs(["🇹🇼 台股", "🇺🇸 美股", "🪙 加密貨幣", "🥇 貴金屬"])
     cat_map = {"台股": "🇹🇼 台股", "美股": "🇺🇸 美股", "加密貨幣": "🪙 加密貨幣", "貴金屬": "🥇 貴金屬"}
+    # groupby 一次拆好各類別，迴圈內就不用每個 tab 都對整張表做布林掃描
+    cat_groups = dict(tuple(holdings_df.groupby('類別', sort=False))) if not holdings_df.empty else {}
+    # 各類別的加總也一次算完（原本每個 tab 重算 3 個 .sum()）
+    cat_sums = (
+        holdings_df.groupby('類別', sort=False)[['市值(TWD)', '損益(TWD)', '成本(TWD)']].sum()
+        if not holdings_df.empty else pd.DataFrame()
+    )
     for i, (internal_cat, display_cat) in enumerate(cat_map.items()):
         with asset_tabs[i]:
-            df_sub = holdings_df[holdings_df['類別'] == internal_cat] if not holdings_df.empty else pd.DataFrame()
+            df_sub = cat_groups.get(internal_cat, pd.DataFrame())
             if not df_sub.empty:
                 # 長條圖：同時顯示『市值』與『占總持倉比例』
                 df_bar = df_sub.sort_values('市值(TWD)').copy()
@@ -1054,9 +1342,21 @@ with tab1:
                 fig_bar.update_xaxes(tickformat=",.0f")
                 st.plotly_chart(fig_bar, use_container_width=True)
 
-                st.dataframe(df_sub[['顯示名稱', '持倉數量', '平均成本', '現價', '市值(TWD)', '損益(TWD)', '報酬率']].style.format({'市值(TWD)': '{:,.0f}', '損益(TWD)': '{:+,.0f}', '報酬率': '{:+.2f}%', '持倉數量': '{:,.4f}', '現價': '{:,.2f}', '平均成本': '{:,.2f}'}), use_container_width=True)
+                # column_config 讓前端做數字格式化，不用每次 rerun 都建 pandas Styler
+                st.dataframe(
+                    df_sub[['顯示名稱', '持倉數量', '平均成本', '現價', '市值(TWD)', '損益(TWD)', '報酬率']],
+                    use_container_width=True,
+                    column_config={
+                        '持倉數量': st.column_config.NumberColumn(format="%.4f"),
+                        '平均成本': st.column_config.NumberColumn(format="%.2f"),
+                        '現價': st.column_config.NumberColumn(format="%.2f"),
+                        '市值(TWD)': st.column_config.NumberColumn(format="%d"),
+                        '損益(TWD)': st.column_config.NumberColumn(format="%d"),
+                        '報酬率': st.column_config.NumberColumn(format="%.2f%%"),
+                    },
+                )
 
-                s_v, s_p, s_c = df_sub['市值(TWD)'].sum(), df_sub['損益(TWD)'].sum(), df_sub['成本(TWD)'].sum()
+                s_v, s_p, s_c = cat_sums.loc[internal_cat] if internal_cat in cat_sums.index else (0, 0, 0)
                 sc1, sc2, sc3 = st.columns(3)
 
                 # 總市值（保留原本顯示，將匯率資訊移到 help，避免與其他元素重疊）
@@ -1095,6 +1395,85 @@ with tab1:
                         unsafe_allow_html=True
                     )
 
+# --- 4. 側邊欄：資產輸入 ---
+with st.sidebar:
+    st.title("🛡️ 雲端資產管理 V7.5")
+    
+    if st.session_state.user:
+        user_email = st.session_state.user.email
+        st.caption(f"👤 已登入: {user_email}")
+        if st.button("登出系統", type="secondary"):
+            # 登出
+            st.session_state.auth_client.auth.sign_out()
+            st.session_state.clear()
+            st.rerun()
+    st.divider()
+
+    with st.form("trade_form", clear_on_submit=True):
+        st.subheader("📝 新增投資交易")
+        t_type = st.radio("交易類型", ["買入", "賣出"], horizontal=True)
+        t_cat = st.selectbox("資產類別", ["台股", "美股", "加密貨幣", "貴金屬"])
+        t_ticker = st.text_input("標的代碼 (如 2330, TSLA)").upper().strip()
+
+        # 台股代碼即時顯示中文名稱（第一次會抓取全量清單並快取）
+        if t_cat == "台股" and t_ticker:
+            tw_name = get_tw_stock_name(t_ticker)
+            if tw_name:
+                st.caption(f"📌 股票名稱：{tw_name}")
+            else:
+                st.caption("⚠️ 查無此台股代碼（仍可存入）")
+        t_qty = st.number_input("數量", min_value=0.0, format="%.4f")
+        t_price = st.number_input("單價", min_value=0.0, format="%.4f")
+        t_date = st.date_input("交易日期", datetime.now())
+        if st.form_submit_button("✅ 存入雲端數據庫"):
+            if t_ticker and t_qty > 0:
+                data = {"user_id": st.session_state.user_id, "類型": t_type, "類別": t_cat, "代碼": t_ticker, "數量": t_qty, "單價": t_price, "日期": t_date.isoformat()}
+                data_client.table("transactions").insert(data).execute()
+                refresh_all_data(); st.rerun()
+
+# --- 5. 主畫面內容 ---
+tab1, tab_liab, tab2, tab3 = st.tabs(["📊 資產儀表板", "📉 負債管理", "💰 收入與流動資金", "🎯 FIRE 規劃"])
+
+# --- Tab 1: 資產儀表板 ---
+with tab1:
+    title_col, filter_col = st.columns([3, 1])
+    with title_col: st.subheader("📊 全球資產概況")
+    with filter_col:
+        time_range = st.selectbox("對比基準點", ["不對比", "日 (前一日)", "月 (前一月)", "年 (前一年)", "自定義"], label_visibility="collapsed")
+    
+    # 執行對比邏輯
+    if time_range == "日 (前一日)": hist_m, hist_l, hist_liab, hist_net = get_historical_stats(days_back=1)
+    elif time_range == "月 (前一月)": hist_m, hist_l, hist_liab, hist_net = get_historical_stats(days_back=30)
+    elif time_range == "年 (前一年)": hist_m, hist_l, hist_liab, hist_net = get_historical_stats(days_back=365)
+    elif time_range == "自定義":
+        d_range = st.date_input("開始日期", value=(datetime.now() - timedelta(days=7)), label_visibility="collapsed")
+        hist_m, hist_l, hist_liab, hist_net = get_historical_stats(start_date=d_range)
+    else: hist_m, hist_l, hist_liab, hist_net = total_market_val, total_liquidity, total_liabilities, net_assets
+
+    net_delta, liq_delta, mkt_delta = net_assets - hist_net, total_liquidity - hist_l, total_market_val - hist_m
+
+    col_m1, col_m2, col_m3, col_m4, col_m5 = st.columns(5)
+    delta_tag = f"({time_range})" if time_range != "不對比" else None
+    
+    with col_m1: st.metric("淨資產 (TWD)", f"NT$ {net_assets:,.0f}", delta=f"{net_delta:,.0f}" if delta_tag else None, help=delta_tag, delta_color="inverse")
+    with col_m2: st.metric("目前流動資金", f"NT$ {total_liquidity:,.0f}", delta=f"{liq_delta:,.0f}" if delta_tag else None, delta_color="inverse")
+    # 原生 st.metric 取代 unsafe_allow_html 的手刻卡片（省掉每次 rerun 的 HTML 解析，
+    # delta_color="inverse" 維持台股「紅漲綠跌」慣例）
+    with col_m3:
+        st.metric("投資總市值", f"NT$ {total_market_val:,.0f}", delta=f"{mkt_delta:+,.0f}" if delta_tag else None, help=delta_tag, delta_color="inverse")
+        st.caption(f"成本: {total_holding_cost:,.0f}")
+    with col_m4:
+        roi_all = (total_pnl / total_holding_cost * 100) if total_holding_cost else 0
+        st.metric("累積總損益", f"NT$ {total_pnl:,.0f}", delta=f"{roi_all:+.2f}% (ROI)", delta_color="inverse")
+    with col_m5: st.metric("總負債額", f"NT$ {total_liabilities:,.0f}", delta=f"-{total_liabilities:,.0f}" if total_liabilities > 0 else None, delta_color="inverse")
+
+    st.divider()
+
+    _render_trend_and_pie(total_market_val, total_liquidity, total_liabilities)
+
+    st.divider()
+    _render_asset_tabs(holdings_df, total_market_val, current_ex_rate)
+
 # --- Tab: 負債管理 ---
 with tab_liab:
     st.header("📉 負債與貸款管理")
@@ -1106,32 +1485,32 @@ with tab_liab:
             l_amt = st.number_input("欠款金額 (TWD)", min_value=0.0)
             if st.form_submit_button("💾 儲存負債"):
                 data_client.table("liabilities").upsert({"user_id": st.session_state.user_id, "category": l_cat, "name": l_name if l_name else l_cat, "amount": l_amt, "updated_at": datetime.now().isoformat()}, on_conflict='user_id, name').execute()
-                fetch_all_data(); st.rerun()
+                refresh_all_data(); st.rerun()
     with l_col2:
         st.subheader("📋 負債明細（可編輯 / 刪除）")
         if st.session_state.liabilities_df.empty:
             st.info("目前尚無負債資料")
         else:
-            liab_src = st.session_state.liabilities_df.copy()
-
-            # 上傳時間 / 更新時間：只顯示到「年-月-日 時:分」
-            if "updated_at" in liab_src.columns:
-                liab_src["updated_at"] = _format_dt_series(liab_src["updated_at"])
+            # 不 copy 整張表：選欄位本身就會建新物件，之後只改 disp 不動 session_state
+            liab_src = st.session_state.liabilities_df
 
-            disp = liab_src.copy()
             show_cols = []
-            if "id" in disp.columns:
+            if "id" in liab_src.columns:
                 show_cols.append("id")
             for c in ["category", "name", "amount", "updated_at"]:
-                if c in disp.columns:
+                if c in liab_src.columns:
                     show_cols.append(c)
-            disp = disp[show_cols].rename(columns={
+            disp = liab_src[show_cols].rename(columns={
                 "category": "負債類別",
                 "name": "項目名稱",
                 "amount": "金額(TWD)",
                 "updated_at": "更新時間",
             })
 
+            # 上傳時間 / 更新時間：只顯示到「年-月-日 時:分」
+            if "更新時間" in disp.columns:
+                disp["更新時間"] = _format_dt_series(disp["更新時間"])
+
 
             # 金額顯示：每三個位數一個逗點
             if "金額(TWD)" in disp.columns:
@@ -1149,7 +1528,7 @@ with tab_liab:
             if st.button("💾 儲存負債表格修改", key="save_liab_btn"):
                 try:
                     _sync_liabilities(liab_src, edited_liab)
-                    fetch_all_data()
+                    refresh_all_data()
                     st.rerun()
                 except Exception as e:
                     st.error(f"❌ 儲存負債修改失敗：{e}")
@@ -1158,7 +1537,7 @@ with tab_liab:
             # 圓餅圖：各負債項目占比
             st.divider()
             st.subheader("🥧 負債項目占比")
-            pie_src = liab_src.copy()
+            pie_src = liab_src
             if (not pie_src.empty) and ("name" in pie_src.columns) and ("amount" in pie_src.columns):
                 pie_data = pie_src.groupby("name", as_index=False)["amount"].sum()
                 pie_data = pie_data[pie_data["amount"] > 0]
@@ -1183,31 +1562,30 @@ with tab2:
             if st.form_submit_button("💾 儲存帳戶"):
                 if acc_name:
                     data_client.table("liquidity").upsert({"user_id": st.session_state.user_id, "account_name": acc_name, "amount": acc_amt, "updated_at": datetime.now().isoformat()}, on_conflict='user_id, account_name').execute()
-                    fetch_all_data(); st.rerun()
+                    refresh_all_data(); st.rerun()
     with liq_col2:
         st.subheader("📋 帳戶明細（可編輯 / 刪除）")
         if st.session_state.liquidity_df.empty:
             st.info("目前尚無流動資金帳戶資料")
         else:
-            liq_src = st.session_state.liquidity_df.copy()
-
-            # 上傳時間 / 更新時間：只顯示到「年-月-日 時:分」
-            if "updated_at" in liq_src.columns:
-                liq_src["updated_at"] = _format_dt_series(liq_src["updated_at"])
+            liq_src = st.session_state.liquidity_df
 
-            disp = liq_src.copy()
             show_cols = []
-            if "id" in disp.columns:
+            if "id" in liq_src.columns:
                 show_cols.append("id")
             for c in ["account_name", "amount", "updated_at"]:
-                if c in disp.columns:
+                if c in liq_src.columns:
                     show_cols.append(c)
-            disp = disp[show_cols].rename(columns={
+            disp = liq_src[show_cols].rename(columns={
                 "account_name": "帳戶名稱",
                 "amount": "金額(TWD)",
                 "updated_at": "更新時間",
             })
 
+            # 上傳時間 / 更新時間：只顯示到「年-月-日 時:分」
+            if "更新時間" in disp.columns:
+                disp["更新時間"] = _format_dt_series(disp["更新時間"])
+
 
             # 金額顯示：每三個位數一個逗點
             if "金額(TWD)" in disp.columns:
@@ -1225,7 +1603,7 @@ with tab2:
             if st.button("💾 儲存流動資金表格修改", key="save_liq_btn"):
                 try:
                     _sync_liquidity(liq_src, edited_liq)
-                    fetch_all_data()
+                    refresh_all_data()
                     st.rerun()
                 except Exception as e:
                     st.error(f"❌ 儲存流動資金修改失敗：{e}")
@@ -1251,38 +1629,34 @@ with tab2:
             note = st.text_input("備註 (例如: 2026年薪)")
             if st.form_submit_button("💾 儲存收入紀錄"):
                 data_client.table("income_history").insert({"user_id": st.session_state.user_id, "紀錄日期": datetime.now().isoformat(), "年收入": ann, "備註": note}).execute()
-                fetch_all_data(); st.rerun()
+                refresh_all_data(); st.rerun()
 
     with col_in2:
         st.subheader("📈 歷史收入與 PR")
         if not st.session_state.income_df.empty:
             curr_ann = st.session_state.income_df['年收入'].iloc[-1]
             ann_wan = curr_ann / 10000
-            user_pr = 0
-            for pr, val in sorted(PR_DATA_113.items()):
-                if ann_wan >= val: user_pr = pr
+            idx = int(np.searchsorted(_PR_VALS, ann_wan, side='right')) - 1
+            user_pr = int(_PR_KEYS[idx]) if idx >= 0 else 0
             st.metric("當前紀錄年收", f"NT$ {curr_ann:,.0f}", help="以最後一筆紀錄為準")
             st.markdown(f"您的年薪領先全台約 **{user_pr}%** 的受薪階級。")
             
             st.write("歷史紀錄（可編輯 / 刪除）")
-            in_src = st.session_state.income_df.copy()
-
-            # 上傳時間：只顯示到「年-月-日 時:分」
-            if "紀錄日期" in in_src.columns:
-                in_src["上傳時間"] = _format_dt_series(in_src["紀錄日期"])
-            else:
-                in_src["上傳時間"] = ""
+            in_src = st.session_state.income_df
 
-            disp_in = in_src.copy()
             show_cols = []
-            if "id" in disp_in.columns:
+            if "id" in in_src.columns:
                 show_cols.append("id")
-            if "上傳時間" in disp_in.columns:
-                show_cols.append("上傳時間")
             for c in ["年收入", "備註"]:
-                if c in disp_in.columns:
+                if c in in_src.columns:
                     show_cols.append(c)
-            disp_in = disp_in[show_cols]
+            disp_in = in_src[show_cols]
+
+            # 上傳時間：只顯示到「年-月-日 時:分」（顯示用欄位，只加在 disp 上）
+            if "紀錄日期" in in_src.columns:
+                disp_in.insert(1 if "id" in disp_in.columns else 0, "上傳時間", _format_dt_series(in_src["紀錄日期"]))
+            else:
+                disp_in.insert(1 if "id" in disp_in.columns else 0, "上傳時間", "")
 
             # 金額顯示：每三個位數一個逗點
             if "年收入" in disp_in.columns:
@@ -1300,7 +1674,7 @@ with tab2:
             if st.button("💾 儲存收入表格修改", key="save_income_btn"):
                 try:
                     _sync_income_history(in_src, edited_in)
-                    fetch_all_data()
+                    refresh_all_data()
                     st.rerun()
                 except Exception as e:
                     st.error(f"❌ 儲存收入修改失敗：{e}")
@@ -1331,7 +1705,7 @@ with tab3:
         
         if st.button("💾 儲存退休設定"):
             data_client.table("user_settings").upsert({"user_id": st.session_state.user_id, "monthly_expense": m_exp, "custom_target": fire_target, "fire_mode": f_mode}).execute()
-            fetch_all_data(); st.rerun()
+            refresh_all_data(); st.rerun()
 
     with col_f2:
         st.subheader("📊 財富森林成長進度")
@@ -1367,27 +1741,29 @@ st.subheader("📜 歷史交易編輯")
 if st.session_state.transactions.empty:
     st.info("尚無交易紀錄")
 else:
-    tx_src = st.session_state.transactions.copy()
+    # 只取要顯示的欄位（選欄位就是新物件），不複製整張交易表
+    tx_src = st.session_state.transactions
+    show_cols = [c for c in ["id", "日期", "類型", "類別", "代碼", "數量", "單價"] if c in tx_src.columns]
+    disp_tx = tx_src[show_cols]
 
     # 日期欄位統一成 date，方便直接編輯
-    if "日期" in tx_src.columns:
-        tx_src["日期"] = pd.to_datetime(tx_src["日期"], errors="coerce").dt.date
+    if "日期" in disp_tx.columns:
+        disp_tx["日期"] = pd.to_datetime(disp_tx["日期"], errors="coerce").dt.date
 
     # 台股代碼 -> 中文名稱（顯示用，不回寫）
-    tx_src["台股名稱"] = ""
+    disp_tx["台股名稱"] = ""
     try:
-        if "類別" in tx_src.columns and "代碼" in tx_src.columns:
-            mask = tx_src["類別"] == "台股"
+        if "類別" in disp_tx.columns and "代碼" in disp_tx.columns:
+            mask = disp_tx["類別"] == "台股"
             if mask.any():
-                def _tw_name_only(code):
-                    base = str(code).upper().replace(".TW", "").strip()
-                    return get_tw_stock_name(base) or ""
-                tx_src.loc[mask, "台股名稱"] = tx_src.loc[mask, "代碼"].apply(_tw_name_only)
+                bases = disp_tx.loc[mask, "代碼"].astype(str).str.upper().str.replace(".TW", "", regex=False).str.strip()
+                name_map = {b: (get_tw_stock_name(b) or "") for b in bases.unique()}
+                disp_tx.loc[mask, "台股名稱"] = bases.map(name_map)
     except Exception:
         pass
 
-    show_cols = [c for c in ["id", "日期", "類型", "類別", "代碼", "台股名稱", "數量", "單價"] if c in tx_src.columns]
-    disp_tx = tx_src[show_cols].sort_values("日期", ascending=False)
+    col_order = [c for c in ["id", "日期", "類型", "類別", "代碼", "台股名稱", "數量", "單價"] if c in disp_tx.columns]
+    disp_tx = disp_tx[col_order].sort_values("日期", ascending=False)
 
     edited_tx = st.data_editor(
         disp_tx,
@@ -1400,7 +1776,7 @@ else:
     if st.button("💾 儲存交易表格修改", key="save_tx_btn"):
         try:
             _sync_transactions(tx_src, edited_tx)
-            fetch_all_data()
+            refresh_all_data()
             st.rerun()
         except Exception as e:
             st.error(f"❌ 儲存交易修改失敗：{e}")
@@ -1,6 +1,38 @@
 import pandas as pd
+import numpy as np
 import streamlit as st
-from utils import supabase, get_display_name
+from concurrent.futures import ThreadPoolExecutor
+from utils import supabase, get_official_tw_map
+
+# numba 可用時把均價/已實現損益的逐筆迴圈 JIT 成機器碼；沒裝就退回純 Python 版
+try:
+    from numba import njit, prange
+    _HAS_NUMBA = True
+except Exception:
+    _HAS_NUMBA = False
+    prange = range
+
+# Arrow backed dtypes：字串欄的 unique / groupby / 比較走 Arrow buffer，比 object dtype 快 2-3 倍
+# （日期欄維持 datetime64，下游還有 .dt 操作）；沒裝 pyarrow 就維持原 dtype
+try:
+    import pyarrow  # noqa: F401
+    _TX_ARROW_DTYPES = {'類型': 'string[pyarrow]', '類別': 'string[pyarrow]', '代碼': 'string[pyarrow]',
+                        '數量': 'float64[pyarrow]', '單價': 'float64[pyarrow]'}
+except Exception:
+    _TX_ARROW_DTYPES = {}
+
+def _to_arrow_tx(df):
+    if not _TX_ARROW_DTYPES:
+        return df
+    cast = {c: t for c, t in _TX_ARROW_DTYPES.items() if c in df.columns}
+    try:
+        return df.astype(cast)
+    except Exception:
+        return df
+
+def empty_transactions_df():
+    """空交易表（欄位與 dtype 與正式載入一致）"""
+    return _to_arrow_tx(pd.DataFrame(columns=['id', 'user_id', '類型', '類別', '代碼', '數量', '單價', '日期']))
 
 def clean_df(df):
     if df.empty: return df
@@ -8,87 +40,258 @@ def clean_df(df):
     df.columns = [str(c).strip() for c in df.columns]
     if '代碼' in df.columns: 
         df['代碼'] = df['代碼'].astype(str).str.strip().str.upper()
-    if '日期' in df.columns: 
-        df['日期'] = pd.to_datetime(df['日期'], errors='coerce')
-    return df.drop_duplicates().reset_index(drop=True)
+    if '日期' in df.columns:
+        # Supabase 回傳的是 ISO 日期字串：指定 format 走 pandas 的 C parser
+        # （不用逐列推斷格式），cache=True 讓重複日期只 parse 一次
+        parsed = pd.to_datetime(df['日期'], errors='coerce', format='ISO8601', cache=True)
+        if parsed.isna().all() and df['日期'].notna().any():
+            # 萬一來源不是 ISO 格式，退回自動推斷
+            parsed = pd.to_datetime(df['日期'], errors='coerce')
+        df['日期'] = parsed
+    if 'id' in df.columns:
+        # id 是資料庫主鍵，整列必不重複；全表逐欄雜湊的 drop_duplicates 是白做工
+        return df.reset_index(drop=True)
+    subset = [c for c in ('代碼', '日期', '類型', '數量', '單價') if c in df.columns]
+    return df.drop_duplicates(subset=subset or None).reset_index(drop=True)
+
+def _id_set(df):
+    """預先算好 id 集合（編輯表格存檔時比對刪除用，不必再掃一次 DataFrame）"""
+    if df.empty or 'id' not in df.columns:
+        return frozenset()
+    return frozenset(pd.to_numeric(df['id'], errors='coerce').dropna().astype('int64'))
+
+@st.cache_data(ttl=60, show_spinner=False)
+def _load_all(user_id):
+    """把所有表一次撈回（60 秒內的 rerun 直接吃快取，不再打 Supabase）
+
+    七張表各是一個獨立的網路 round trip，用 thread pool 同時發出，
+    整體等待從 sum(RTT) 降到 max(RTT)（supabase-py 底層的 httpx client 可跨執行緒共用）。
+    """
+    queries = {
+        # 1. 交易紀錄
+        'transactions': lambda: supabase.table("transactions").select("*").eq("user_id", user_id).order("日期", desc=True).execute(),
+        # 2. 收入歷史
+        'income_df': lambda: supabase.table("income_history").select("*").eq("user_id", user_id).execute(),
+        # 3. 負債資料
+        'liabilities_df': lambda: supabase.table("liabilities").select("*").eq("user_id", user_id).execute(),
+        # 4. 流動資金 (多帳戶)
+        'liquidity_df': lambda: supabase.table("liquidity").select("*").eq("user_id", user_id).execute(),
+        # 5. 現金歷史 (備用)
+        'cash_df': lambda: supabase.table("cash_history").select("*").eq("user_id", user_id).order("record_date", desc=True).execute(),
+        # 6. 資產快照紀錄
+        'snapshots_df': lambda: supabase.table("portfolio_snapshots").select("*").eq("user_id", user_id).order("snapshot_date", desc=True).execute(),
+        # 7. 使用者設定
+        'settings': lambda: supabase.table("user_settings").select("*").eq("user_id", user_id).execute(),
+    }
+    with ThreadPoolExecutor(max_workers=len(queries)) as pool:
+        futs = {key: pool.submit(fn) for key, fn in queries.items()}
+        res = {key: fut.result() for key, fut in futs.items()}
+
+    data = {key: pd.DataFrame(res[key].data)
+            for key in ('income_df', 'liabilities_df', 'liquidity_df', 'cash_df', 'snapshots_df')}
+    data['transactions'] = _to_arrow_tx(clean_df(pd.DataFrame(res['transactions'].data)))
+
+    # 快照日期載入時就轉成 datetime64，下游（歷史對比索引/趨勢圖聚合）不用各自再 parse 一次
+    snaps = data['snapshots_df']
+    if not snaps.empty and 'snapshot_date' in snaps.columns:
+        snaps['snapshot_date'] = pd.to_datetime(snaps['snapshot_date'], errors='coerce')
+
+    if res['settings'].data:
+        data['settings'] = res['settings'].data[0]
+    else:
+        data['settings'] = {"monthly_expense": 80000, "fire_mode": "依月開銷推算 (25倍法則)", "custom_target": 24000000}
+
+    return data
 
 def fetch_all_data():
-    u_id = st.session_state.user_id
-    
-    # 1. 交易紀錄
-    tx_res = supabase.table("transactions").select("*").eq("user_id", u_id).order("日期", desc=True).execute()
-    st.session_state.transactions = clean_df(pd.DataFrame(tx_res.data))
-    
-    # 2. 收入歷史
-    in_res = supabase.table("income_history").select("*").eq("user_id", u_id).execute()
-    st.session_state.income_df = pd.DataFrame(in_res.data)
-    
-    # 3. 負債資料
-    liab_res = supabase.table("liabilities").select("*").eq("user_id", u_id).execute()
-    st.session_state.liabilities_df = pd.DataFrame(liab_res.data)
-    
-    # 4. 流動資金 (多帳戶)
-    liq_res = supabase.table("liquidity").select("*").eq("user_id", u_id).execute()
-    st.session_state.liquidity_df = pd.DataFrame(liq_res.data)
-    
-    # 5. 現金歷史 (備用)
-    cash_res = supabase.table("cash_history").select("*").eq("user_id", u_id).order("record_date", desc=True).execute()
-    st.session_state.cash_df = pd.DataFrame(cash_res.data)
-
-    # 6. 新增：資產快照紀錄
-    snap_res = supabase.table("portfolio_snapshots").select("*").eq("user_id", u_id).order("snapshot_date", desc=True).execute()
-    st.session_state.snapshots_df = pd.DataFrame(snap_res.data)
-    
-    # 7. 使用者設定
-    set_res = supabase.table("user_settings").select("*").eq("user_id", u_id).execute()
-    if set_res.data: 
-        st.session_state.settings = set_res.data[0]
-    else: 
-        st.session_state.settings = {"monthly_expense": 80000, "fire_mode": "依月開銷推算 (25倍法則)", "custom_target": 24000000}
+    data = _load_all(st.session_state.user_id)
+
+    st.session_state.transactions = data['transactions']
+    st.session_state.transactions_ids = _id_set(st.session_state.transactions)
+    st.session_state.income_df = data['income_df']
+    st.session_state.income_history_ids = _id_set(st.session_state.income_df)
+    st.session_state.liabilities_df = data['liabilities_df']
+    st.session_state.liabilities_ids = _id_set(st.session_state.liabilities_df)
+    st.session_state.liquidity_df = data['liquidity_df']
+    st.session_state.liquidity_ids = _id_set(st.session_state.liquidity_df)
+    st.session_state.cash_df = data['cash_df']
+    st.session_state.snapshots_df = data['snapshots_df']
+    st.session_state.settings = data['settings']
+
+def refresh_all_data():
+    """寫入 Supabase 之後呼叫：清掉快取並立刻重撈，避免吃到 60 秒內的舊資料"""
+    _load_all.clear()
+    fetch_all_data()
 
 def save_daily_snapshot(m_val, l_val, liab_val, net_val):
     """每日自動存檔當前資產狀態"""
     u_id = st.session_state.user_id
+    today = pd.Timestamp.now().date().isoformat()
+
+    # 每次 rerun 都會呼叫到這裡；同一天、同數值的 upsert 是純浪費的網路 round trip，
+    # 記住上次寫入的指紋，沒變就直接跳過
+    fp = (today, round(float(m_val), 2), round(float(l_val), 2),
+          round(float(liab_val), 2), round(float(net_val), 2))
+    if st.session_state.get('_last_snapshot_fp') == fp:
+        return
+
+    # 本 session 還沒寫過：先比對剛載回來的快照表，今天的紀錄若已一致，
+    # 連第一次 RPC 都省下來（容差 1 元，避免浮點尾數造成假性差異）
+    snaps = st.session_state.get('snapshots_df')
+    if snaps is not None and not snaps.empty and 'snapshot_date' in snaps.columns:
+        try:
+            dates = pd.to_datetime(snaps['snapshot_date'], errors='coerce').dt.strftime('%Y-%m-%d')
+            today_rows = snaps[(dates == today).to_numpy()]
+            if not today_rows.empty:
+                row = today_rows.iloc[0]
+                if all(abs(float(row[col]) - val) < 1.0
+                       for col, val in (("market_value", float(m_val)),
+                                        ("liquidity_amount", float(l_val)),
+                                        ("liabilities_amount", float(liab_val)),
+                                        ("net_assets", float(net_val)))):
+                    st.session_state['_last_snapshot_fp'] = fp
+                    return
+        except Exception:
+            pass
+
     data = {
         "user_id": u_id,
         "market_value": m_val,
         "liquidity_amount": l_val,
         "liabilities_amount": liab_val,
         "net_assets": net_val,
-        "snapshot_date": pd.Timestamp.now().date().isoformat()
+        "snapshot_date": today
     }
     # 使用 upsert，如果今天存過了就更新今天的紀錄
     try:
         supabase.table("portfolio_snapshots").upsert(data, on_conflict='user_id, snapshot_date').execute()
+        st.session_state['_last_snapshot_fp'] = fp
     except:
         pass
 
-def calculate_detailed_metrics(df, ex_rate):
-    if df.empty: return pd.DataFrame(), 0, df.assign(**{'每筆損益(原幣)': 0.0})
-    holdings, realized_pnl_twd = [], 0 
-    temp_df = df.sort_values('日期').copy()
-    tracker, row_pnls_orig = {}, []
-    
-    for _, row in temp_df.iterrows():
-        t, cat = str(row['代碼']).strip().upper(), row['類別']
-        if t not in tracker: tracker[t] = {'qty': 0, 'cost_basis': 0}
-        pnl = 0
-        if row['類型'] == '買入':
-            new_qty = tracker[t]['qty'] + row['數量']
-            if new_qty > 0: 
-                tracker[t]['cost_basis'] = ((tracker[t]['qty'] * tracker[t]['cost_basis']) + (row['數量'] * row['單價'])) / new_qty
-            tracker[t]['qty'] = new_qty
+def _walk_transactions(ticker_ids, flags, qtys, prices, n_tickers):
+    """依時間序一次走完全部交易（flags: 1=買入 0=賣出）
+
+    SoA 版：代碼先經 pd.factorize 轉成密集 int id，持倉/均價各用一條
+    float64 陣列以 id 索引，整張表只跑一個迴圈、只呼叫一次 kernel
+    （原本每個標的 groupby 一組再各呼叫一次）。
+    回傳 (各標的最終持倉, 各標的平均成本, 每筆損益(原幣) 陣列)。
+    純數值迴圈，numba 可直接 JIT。
+    """
+    cur_qty = np.zeros(n_tickers)
+    cur_cb = np.zeros(n_tickers)
+    pnls = np.zeros(ticker_ids.shape[0])
+    for i in range(ticker_ids.shape[0]):
+        t = ticker_ids[i]
+        if flags[i] == 1:
+            new_q = cur_qty[t] + qtys[i]
+            if new_q > 0:
+                cur_cb[t] = ((cur_qty[t] * cur_cb[t]) + (qtys[i] * prices[i])) / new_q
+            cur_qty[t] = new_q
         else:
-            pnl = (row['單價'] - tracker[t]['cost_basis']) * row['數量']
-            realized_pnl_twd += (pnl * (1.0 if cat == "台股" else ex_rate))
-            tracker[t]['qty'] -= row['數量']
-        row_pnls_orig.append(pnl)
-        
-    for t, info in tracker.items():
-        if info['qty'] > 0.0001:
-            match = df[df['代碼'] == t]
-            cat = match['類別'].iloc[0] if not match.empty else "台股"
-            holdings.append({'代碼': t, '顯示名稱': get_display_name(t), '持倉數量': info['qty'], '平均成本': info['cost_basis'], '類別': cat})
-    
-    temp_df['每筆損益(原幣)'] = row_pnls_orig
-    return pd.DataFrame(holdings), realized_pnl_twd, temp_df
\ No newline at end of file
+            pnls[i] = (prices[i] - cur_cb[t]) * qtys[i]
+            cur_qty[t] -= qtys[i]
+    return cur_qty, cur_cb, pnls
+
+def _walk_transactions_parallel(starts, flags, qtys, prices, n_tickers):
+    """_walk_transactions 的多執行緒版
+
+    均價走訪只在「同一標的」內有先後相依，標的之間互相獨立，
+    所以先把交易依 ticker id 排成連續區段（starts 是各區段起點），
+    再用 prange 依標的切平行。交易筆數夠多時才划算（見呼叫端門檻）。
+    """
+    cur_qty = np.zeros(n_tickers)
+    cur_cb = np.zeros(n_tickers)
+    pnls = np.zeros(flags.shape[0])
+    for t in prange(n_tickers):
+        q, cb = 0.0, 0.0
+        for i in range(starts[t], starts[t + 1]):
+            if flags[i] == 1:
+                new_q = q + qtys[i]
+                if new_q > 0:
+                    cb = ((q * cb) + (qtys[i] * prices[i])) / new_q
+                q = new_q
+            else:
+                pnls[i] = (prices[i] - cb) * qtys[i]
+                q -= qtys[i]
+        cur_qty[t] = q
+        cur_cb[t] = cb
+    return cur_qty, cur_cb, pnls
+
+# 平行版只有在交易筆數夠多時才贏得回 thread 啟動成本
+_PARALLEL_MIN_ROWS = 5000
+
+if _HAS_NUMBA:
+    # 明確 signature：import 時就編譯並寫入 numba 的磁碟快取，
+    # 首次互動不用等 lazy JIT，worker 重啟後直接載入編譯好的產物
+    _walk_transactions = njit(
+        'Tuple((float64[:], float64[:], float64[:]))(int64[:], int8[:], float64[:], float64[:], int64)',
+        cache=True,
+    )(_walk_transactions)
+    _walk_transactions_parallel = njit(
+        'Tuple((float64[:], float64[:], float64[:]))(int64[:], int8[:], float64[:], float64[:], int64)',
+        cache=True, parallel=True,
+    )(_walk_transactions_parallel)
+
+def calculate_detailed_metrics(df, ex_rate, detailed=True):
+    """計算持倉與已實現損益
+
+    detailed=False 時第三個回傳值為 None，省掉逐筆損益明細表的組裝
+    （儀表板只用前兩個回傳值，不需要明細）。
+    """
+    if df.empty: return pd.DataFrame(), 0, (df.assign(**{'每筆損益(原幣)': 0.0}) if detailed else None)
+    temp_df = df.sort_values('日期').reset_index(drop=True)
+
+    # 先把欄位抽成純數值 ndarray，逐筆會計迴圈交給 _walk_transactions（可 JIT）
+    codes = temp_df['代碼'].astype(str).str.strip().str.upper()
+    ticker_ids, uniques = pd.factorize(codes, sort=False)
+    ticker_ids = ticker_ids.astype(np.int64)
+    flags = (temp_df['類型'].to_numpy() == '買入').astype(np.int8)
+    qtys = pd.to_numeric(temp_df['數量'], errors='coerce').fillna(0).to_numpy(dtype=np.float64)
+    prices = pd.to_numeric(temp_df['單價'], errors='coerce').fillna(0).to_numpy(dtype=np.float64)
+
+    if _HAS_NUMBA and len(temp_df) >= _PARALLEL_MIN_ROWS and len(uniques) > 1:
+        # 大表改走平行 kernel：先依 ticker id 穩定排序成連續區段（區段內仍是日期序），
+        # 算完再把每筆損益散回原本的列順序
+        perm = np.argsort(ticker_ids, kind='stable')
+        counts = np.bincount(ticker_ids, minlength=len(uniques))
+        starts = np.concatenate((np.zeros(1, dtype=np.int64), np.cumsum(counts))).astype(np.int64)
+        cur_qty, cur_cb, pnls_sorted = _walk_transactions_parallel(
+            starts, flags[perm], qtys[perm], prices[perm], len(uniques))
+        pnls = np.empty_like(pnls_sorted)
+        pnls[perm] = pnls_sorted
+    else:
+        cur_qty, cur_cb, pnls = _walk_transactions(ticker_ids, flags, qtys, prices, len(uniques))
+
+    # 各標的的類別取第一筆出現值（id 是依出現順序編的，return_index 剛好對上）
+    if '類別' in temp_df.columns:
+        _, first_pos = np.unique(ticker_ids, return_index=True)
+        cats_by_ticker = temp_df['類別'].to_numpy()[first_pos]
+    else:
+        cats_by_ticker = np.full(len(uniques), "台股", dtype=object)
+
+    held = cur_qty > 0.0001
+    held_codes = np.asarray(uniques, dtype=object)[held]
+
+    # 顯示名稱整批查一次（逐檔呼叫 get_display_name 每次都要 probe 快取 dict 再組字串）
+    code_s = pd.Series(held_codes, dtype=object)
+    names = code_s.str.replace('.TW', '', regex=False).map(get_official_tw_map()).fillna('')
+    disp = np.where(names.to_numpy() != '', (names + ' (' + code_s + ')').to_numpy(), held_codes)
+
+    holdings_df = pd.DataFrame({
+        '代碼': held_codes,
+        '顯示名稱': disp,
+        '持倉數量': cur_qty[held],
+        '平均成本': cur_cb[held],
+        '類別': cats_by_ticker[held],
+    })
+
+    # 已實現損益換算台幣：台股 1:1，其餘用匯率（向量化，一次算完）
+    cats = temp_df['類別'].to_numpy()
+    realized_pnl_twd = float((pnls * np.where(cats == "台股", 1.0, ex_rate)).sum())
+
+    if not detailed:
+        return holdings_df, realized_pnl_twd, None
+
+    temp_df['每筆損益(原幣)'] = pnls
+    return holdings_df, realized_pnl_twd, temp_df
\ No newline at end of file
@@ -1,13 +1,18 @@
 import streamlit as st
 import pandas as pd
-import yfinance as yf
+import numpy as np
 import requests
 import urllib3
+from io import BytesIO
 from supabase import create_client, Client
 
 # 忽略不安全的請求警告
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+# 共用的 HTTP Session：連線池 + keep-alive，worker 重啟補抓清單時不必每次重付 TCP/TLS 握手
+_HTTP_SESSION = requests.Session()
+_HTTP_SESSION.headers.update({'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'})
+
 # --- 修改 1: 讓 Client 變數可以被更新 ---
 # 我們不直接暴露一個固定的 client，而是提供一個函數來獲取或初始化
 _supabase_client = None
@@ -43,13 +48,12 @@ def update_supabase_session(access_token, refresh_token):
 @st.cache_resource(ttl=86400)
 def get_official_tw_map():
     """從證交所抓取最新的台股代碼與名稱對照表"""
-    headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
     url = "https://isin.twse.com.tw/isin/C_public.jsp?strMode=2"
     master_map = {}
     try:
-        res = requests.get(url, headers=headers, timeout=15, verify=False)
-        res.encoding = 'cp950'
-        df_list = pd.read_html(res.text, flavor='lxml')
+        res = _HTTP_SESSION.get(url, timeout=15, verify=False)
+        # 直接把 bytes 丟給 lxml 解，省掉 res.text 先在 Python 層 decode 出一整份 str
+        df_list = pd.read_html(BytesIO(res.content), flavor='lxml', encoding='cp950')
         if df_list:
             df = df_list[0]
             for val in df[0].dropna():
@@ -77,29 +81,64 @@ def get_display_name(ticker):
 def get_market_data(tickers, period="5d"):
     """獲取即時/歷史現價與台幣匯率"""
     if not tickers: return {}, 32.5
-    t_list = list(set([str(t).strip().upper() for t in tickers if pd.notna(t)]))
-    query_list = [t if (".TW" in t or "-" in t) else f"{t}-USD" if t in ["BTC", "ETH", "SOL", "USDT"] else f"{t}.TW" if t.isdigit() else t for t in t_list]
-    try:
+    # 排序去重後當快取 key，同一組持倉的 rerun 不會重打 yfinance
+    t_key = tuple(sorted(set([str(t).strip().upper() for t in tickers if pd.notna(t)])))
+    prices, ex_rate = _download_market_data(t_key, period)
+    if not prices:
+        # 快取到的是失敗結果（yfinance 偶發斷線）就清掉重抓一次，
+        # 不要讓整個 ttl 內都拿空報價
+        _download_market_data.clear()
+        prices, ex_rate = _download_market_data(t_key, period)
+    return prices, ex_rate
+
+@st.cache_data(ttl=300, show_spinner=False)
+def _download_market_data(t_key, period="5d"):
+    """實際下載報價（5 分鐘內相同 ticker 組合直接吃快取）"""
+    # yfinance 的 import 重（連帶拉進一整串相依套件），延後到真的要打報價才載入；
+    # 之後的呼叫走 sys.modules 快取，不會重付成本
+    import yfinance as yf
+    # 查詢代號一次用 np.select 算完（原本每個 ticker 走一次 4 分支 Python 條件式），
+    # 順便留下 orig -> 查詢代號 的對照，下面取價不必再判斷一次
+    s = pd.Series(t_key, dtype="object").astype(str)
+    mask_passthru = s.str.contains(".TW", regex=False) | s.str.contains("-", regex=False)
+    mask_crypto = s.isin(["BTC", "ETH", "SOL", "USDT"])
+    mask_digit = s.str.isdigit()
+    query_arr = np.select([mask_passthru, mask_crypto, mask_digit], [s, s + "-USD", s + ".TW"], default=s)
+    t_list = list(t_key)
+    query_list = query_arr.tolist()
+    q_map = dict(zip(t_list, query_list))
+    def _fetch(p):
         # 下載包含匯率的數據
-        data = yf.download(list(set(query_list + ["TWD=X"])), period=period, progress=False)
-        
+        data = yf.download(list(set(query_list + ["TWD=X"])), period=p, progress=False)
+
         # 相容 yfinance 不同版本的資料結構
         if isinstance(data.columns, pd.MultiIndex):
             close_data = data['Close']
         else:
             close_data = data
-            
+
+        # 一次 ffill 取出所有欄位的最後一個有效收盤價，
+        # 不必逐 ticker 做欄位切片 + dropna + iloc（每次都是一組 pandas 呼叫）
+        latest = close_data.ffill().iloc[-1]
+
         # 取得最新匯率
         ex_rate = 32.5
-        if "TWD=X" in close_data.columns:
-            val = close_data["TWD=X"].dropna().iloc[-1]
-            if pd.notna(val): ex_rate = val
-        
-        prices = {}
-        for orig in t_list:
-            q_t = orig if (".TW" in orig or "-" in orig) else f"{orig}-USD" if orig in ["BTC", "ETH", "SOL"] else f"{orig}.TW" if orig.isdigit() else orig
-            if q_t in close_data.columns: 
-                val = close_data[q_t].dropna().iloc[-1]
-                if pd.notna(val): prices[orig] = val
+        if "TWD=X" in latest.index and pd.notna(latest["TWD=X"]):
+            ex_rate = float(latest["TWD=X"])
+
+        prices = {orig: float(latest[q_t])
+                  for orig, q_t in q_map.items()
+                  if q_t in latest.index and pd.notna(latest[q_t])}
+        return prices, ex_rate
+
+    try:
+        # 只用得到最後一筆收盤價，先抓 1 天就好（period='5d' 是近 5 倍的無謂傳輸）
+        try:
+            prices, ex_rate = _fetch("1d")
+        except Exception:
+            prices, ex_rate = {}, 32.5
+        if len(prices) < len(t_list):
+            # 休市日部分標的當天沒有資料，退回較長區間補齊
+            prices, ex_rate = _fetch(period)
         return prices, ex_rate
     except: return {}, 32.5
\ No newline at end of file